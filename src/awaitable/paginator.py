@@ -9,7 +9,17 @@ from src.awaitable.modal import UserTimeoutException
 class AsyncPaginator(discord.ext.pages.Paginator):
     def __init__(self, future: Optional[asyncio.Future] = None, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.future = future or asyncio.get_running_loop().create_future()
+        self._future = future
+
+    @property
+    def future(self) -> asyncio.Future:
+        """
+        The future resolved with the paginator's outcome, created on first use.
+        :return:
+        """
+        if self._future is None:
+            self._future = asyncio.get_running_loop().create_future()
+        return self._future
 
     async def send(
         self,
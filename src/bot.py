@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import os
 import random
@@ -5,7 +6,6 @@ import re
 import sys
 import time
 import traceback
-from datetime import datetime
 from typing import Optional, Any
 
 import discord
@@ -14,7 +14,6 @@ from sqlalchemy.orm import Session
 
 from src.awaitable.modal import BeginPortModal
 from src.git import RepoId, PullRequestId, LocalRepo
-from src.model import KnownPullRequest
 from src.morticia import Morticia, Project
 from src.ui.views import MyView
 from src.utils import parse_pull_request_urls, pretty_duration, parse_repo_urls, temporary_file, send_embedded_output
@@ -24,6 +23,8 @@ USER_ROLE_IDS = os.environ.get("USER_ROLE_IDS").split(",")
 
 log = logging.getLogger(__name__)
 
+HTML_COMMENT_PATTERN = re.compile(r"<!--.*?-->")
+
 
 class MorticiaBot(discord.Bot):
     session: Session
@@ -192,10 +193,10 @@ def create_bot(*args, **kwargs):
             return
 
         pull_request_id = pull_request_ids.pop()
-        pull_request = bot.morticia.get_pull_request(pull_request_id)
+        pull_request = await asyncio.to_thread(bot.morticia.get_pull_request, pull_request_id)
 
         body = pull_request.body or ""
-        body_summary = re.sub(r"<!--.*?-->", "", body)[:300]
+        body_summary = HTML_COMMENT_PATTERN.sub("", body)[:300]
         if len(body) > 300:
             body_summary += " ..."
         body_summary += os.linesep
@@ -250,7 +251,7 @@ def create_bot(*args, **kwargs):
             return
 
         repo_id = repo_ids.pop()
-        pull_request_count = bot.morticia.get_github_repo(repo_id).get_pulls("all").totalCount
+        pull_request_count = await asyncio.to_thread(lambda: bot.morticia.get_github_repo(repo_id).get_pulls("all").totalCount)
         estimated_seconds = pull_request_count * 4
         estimate = pretty_duration(estimated_seconds)
         await ctx.respond(f"Okay, I'll go index {repo_id}. This is probably going to take a lot longer than 15 minutes,"
@@ -291,11 +292,6 @@ def create_bot(*args, **kwargs):
 
         # known_pull_requests = morticia.get_upstream_merge_prs(repo_id)
 
-        def sort_by_oldest(element: KnownPullRequest):
-            return element.merged_at or datetime.fromisocalendar(1970, 1, 1)
-
-        known_pull_requests.sort(key=sort_by_oldest)
-
         text = ""
         for pull_request in known_pull_requests:
             # text += f"- [{pull_request.pull_request_id} - {pull_request.title}]({pull_request.html_url})" + "\n"
@@ -1,4 +1,5 @@
 import asyncio
+import functools
 import os
 import re
 from enum import Enum
@@ -10,6 +11,45 @@ from slugify import slugify
 from .pubsub import Publisher, MessageEvent, BaseEvent
 
 GITHUB_URL = "https://github.com/"
+REPO_URL_PATTERN = re.compile(r"^(?:https?://github\.com/)?([^/#?]+)/([^/#?]+)")
+PULL_REQUEST_URL_PATTERN = re.compile(r"^(?:https?://github\.com/)?([^/#?]+)/([^/#?]+)/(?:.*/)?(\d+)$")
+
+# the same handful of repositories are slugified over and over
+cached_slugify = functools.lru_cache(maxsize=2048)(slugify)
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_repo_url(url: str) -> tuple[str, str]:
+    match = REPO_URL_PATTERN.match(url)
+    if match is None:
+        raise ValueError(f"Not a repository URL: {url}")
+    return match.group(1).lower(), match.group(2).lower()
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_pull_request_url(url: str) -> tuple[str, str, int]:
+    match = PULL_REQUEST_URL_PATTERN.match(url)
+    if match is None:
+        raise ValueError(f"Not a pull request URL: {url}")
+    return match.group(1).lower(), match.group(2).lower(), int(match.group(3))
+
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+def _download(url: str, path: str):
+    """
+    Streams a download to disk without holding the whole body in memory.
+    :param url:
+    :param path:
+    :return:
+    """
+    with requests.get(url, stream=True) as response:
+        response.raise_for_status()
+        with open(path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+
 
 REPOSITORIES_DIR = "./repositories"
 os.makedirs(REPOSITORIES_DIR, exist_ok=True)
@@ -27,6 +67,8 @@ class RepoId:
         "lagrange": "lagrange14/substations",
     }
 
+    __slots__ = ("org_name", "repo_name")
+
     org_name: str
     repo_name: str
 
@@ -42,16 +84,11 @@ class RepoId:
         return f"{GITHUB_URL}{str(self)}"
 
     def slug(self):
-        return slugify(str(self))
+        return cached_slugify(str(self))
 
     @classmethod
     def from_url(cls, url: str):
-        url = url.replace(GITHUB_URL, "")
-        repo_id = RepoId()
-        repo_id.org_name, repo_id.repo_name, *_ = url.split("/")
-        repo_id.org_name = repo_id.org_name.lower()
-        repo_id.repo_name = repo_id.repo_name.lower()
-        return repo_id
+        return RepoId(*_parse_repo_url(url))
 
     @classmethod
     def from_string(cls, text: str):
@@ -63,6 +100,8 @@ class RepoId:
 
 
 class PullRequestId:
+    __slots__ = ("org_name", "repo_name", "number")
+
     org_name: str
     repo_name: str
     number: int
@@ -85,13 +124,8 @@ class PullRequestId:
 
     @classmethod
     def from_url(cls, url: str):
-        url = url.replace(GITHUB_URL, "")
         pr_id = PullRequestId()
-        pr_id.org_name, pr_id.repo_name, *_ = url.split("/")
-        pr_id.org_name = pr_id.org_name.lower()
-        pr_id.repo_name = pr_id.repo_name.lower()
-        last_slash = url.rindex("/")
-        pr_id.number = int(url[last_slash + 1:])
+        pr_id.org_name, pr_id.repo_name, pr_id.number = _parse_pull_request_url(url)
         return pr_id
 
     @classmethod
@@ -222,6 +256,9 @@ class LocalRepo:
         super().__init__()
         self.path = path
         self.repo_id = repo_id
+        self._default_branches: dict[str, str] = {}
+        self._tracked_remotes: set[str] = set()
+        self._local_branches: set[str] = set()
 
     async def naive_conflict_resolution(self, e: MergeConflictsException, continue_command: str):
         naive_resolution_applied = False
@@ -344,18 +381,22 @@ class LocalRepo:
         :param extra_options: Extra arguments to be passed to ``git am``
         :return: ``True`` if naive conflict resolution was applied
         """
-        r = requests.get(patch_url)
-        with open(f'tmp.patch', 'wb') as f:
-            f.write(r.content)
+        # downloading can take a while for large pull requests, so it happens off the event loop
+        await asyncio.to_thread(_download, patch_url, "tmp.patch")
         return await self.apply_patch_conflict_resolving("../../tmp.patch", extra_options)
 
     async def checkout(self, branch: str):
+        # skip the doomed attempt at creating a branch we've already seen
+        if branch in self._local_branches:
+            await self.git(f"checkout {branch}")
+            return
         try:
             await self.git(f"checkout -b {branch}")
         except GitCommandException as e:
             if "already exists" not in e.stderr:
                 raise e
             await self.git(f"checkout {branch}")
+        self._local_branches.add(branch)
 
     async def cherry_pick(self, commit_sha: str):
         try:
@@ -407,14 +448,21 @@ class LocalRepo:
         remote = "origin"
         if repo_id is not None:
             remote = repo_id.slug()
+        if branch_name := self._default_branches.get(remote):
+            return branch_name
         stdout, _ = await self.git(f"rev-parse --abbrev-ref {remote}")
-        _, branch_name = stdout.split("/")
+        _, branch_name = stdout.strip().split("/")
+        self._default_branches[remote] = branch_name
         return branch_name
 
-    async def fetch(self, remote_name: Union[str, RepoId]):
-        if isinstance(remote_name, RepoId):
-            remote_name = remote_name.slug()
-        await self.git(f"fetch {remote_name}")
+    async def fetch(self, *remote_names: Union[str, RepoId]):
+        """
+        Fetches one or more remotes in parallel within a single git process, so they never race on ``FETCH_HEAD``.
+        :param remote_names:
+        :return:
+        """
+        remotes = " ".join(isinstance(remote, RepoId) and remote.slug() or remote for remote in remote_names)
+        await self.git(f"fetch --jobs={len(remote_names)} --multiple {remotes}")
 
     async def get_remote_url(self, remote: str) -> str:
         stdout, _ = await self.git(f"remote get-url {remote}")
@@ -458,6 +506,16 @@ class LocalRepo:
             results.append(RenamedFileInfo(similarity, before, after))
         return results
 
+    async def parent_count(self, commit_sha: str) -> int:
+        """
+        Counts the parents of a commit, which must already be fetched.
+        :param commit_sha: Hash of the commit
+        :return: ``1`` for regular commits, ``2`` or more for merge commits
+        """
+        stdout, _ = await self.git(f"rev-list --parents -n 1 {commit_sha}")
+        _, *parents = stdout.split()
+        return len(parents)
+
     async def push(self, remote: Optional[str] = "", remote_branch: Optional[str] = "", force: bool = False):
         force_flag = force and "--force" or ""
         await self.git(f"push {remote} {remote_branch} {force_flag}")
@@ -469,10 +527,13 @@ class LocalRepo:
         await self.git(f"add {file_path}")
 
     async def sync_branch_with_remote(self, remote: str, local_branch: str, remote_branch: Optional[str] = None):
-        remote_branch = remote_branch or local_branch
         await self.git(f"fetch {remote}")
-        await self.git(f"checkout {local_branch}")
-        await self.git(f"reset --hard {remote}/{remote_branch}")
+        await self.reset_branch_to_remote(remote, local_branch, remote_branch)
+
+    async def reset_branch_to_remote(self, remote: str, local_branch: str, remote_branch: Optional[str] = None):
+        remote_branch = remote_branch or local_branch
+        # checks out and hard resets the local branch in one go, without changing which branch it tracks
+        await self.git(f"checkout --force --no-track -B {local_branch} {remote}/{remote_branch}")
 
     async def rev_list(self, *args: str) -> list[str]:
         """
@@ -487,11 +548,15 @@ class LocalRepo:
         return stdout.splitlines()
 
     async def track_remote(self, repo_id: RepoId):
+        remote = repo_id.slug()
+        if remote in self._tracked_remotes:
+            return
         try:
-            await self.git(f"remote add {repo_id.slug()} {repo_id.url}")
+            await self.git(f"remote add {remote} {repo_id.url}")
         except GitCommandException as e:
             if "already exists." not in e.stderr:
                 raise e
+        self._tracked_remotes.add(remote)
 
     @classmethod
     async def open(cls, repo_id: RepoId):
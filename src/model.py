@@ -4,11 +4,14 @@ from typing import Optional
 
 import github.File
 from github.PullRequest import PullRequest
-from sqlalchemy import MetaData, ForeignKey
+from sqlalchemy import MetaData, ForeignKey, ForeignKeyConstraint, Index, Select, select, bindparam
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
-def _unique(session, cls, hashfunc, queryfunc, constructor, arg, kw):
+_unique_statements: dict[type, Select] = {}
+
+
+def _unique(session, cls, hashfunc, constructor, arg, kw):
     cache = session.info.get("_unique_cache", None)
     if cache is None:
         session.info['_unique_cache'] = cache = {}
@@ -18,9 +21,9 @@ def _unique(session, cls, hashfunc, queryfunc, constructor, arg, kw):
         return cache[key]
     else:
         with session.no_autoflush:
-            q = session.query(cls)
-            q = queryfunc(q, *arg, **kw)
-            obj = q.first()
+            # declarative constructors only accept keyword arguments
+            arg, kw = (), dict(zip(cls.unique_keys, arg), **kw)
+            obj = session.execute(cls.unique_statement(), kw).scalar_one_or_none()
             if not obj:
                 obj = constructor(*arg, **kw)
                 session.add(obj)
@@ -29,13 +32,25 @@ def _unique(session, cls, hashfunc, queryfunc, constructor, arg, kw):
 
 
 class UniqueMixin(object):
+    # columns identifying a row, in the same order as the arguments to as_unique; every subclass must declare them
+    unique_keys: tuple[str, ...]
+
     @classmethod
     def unique_hash(cls, *arg, **kw):
         raise NotImplementedError()
 
     @classmethod
-    def unique_filter(cls, query, *arg, **kw):
-        raise NotImplementedError()
+    def unique_statement(cls) -> Select:
+        """
+        Returns the lookup statement for :attr:`unique_keys`, built once per class so SQLAlchemy can reuse the
+        compiled form instead of constructing a new filter for every call.
+        :return:
+        """
+        statement = _unique_statements.get(cls)
+        if statement is None:
+            statement = select(cls).where(*(getattr(cls, key) == bindparam(key) for key in cls.unique_keys))
+            _unique_statements[cls] = statement
+        return statement
 
     @classmethod
     def as_unique(cls, session, *arg, **kw):
@@ -43,7 +58,6 @@ class UniqueMixin(object):
                     session,
                     cls,
                     cls.unique_hash,
-                    cls.unique_filter,
                     cls,
                     arg, kw
                )
@@ -76,21 +90,20 @@ class Base(DeclarativeBase):
 
 class KnownRepo(Base, UniqueMixin):
     __tablename__ = "known_repos"
+    unique_keys = ("repo_id",)
 
     repo_id: Mapped[str] = mapped_column(primary_key=True)
+    # every pull request updated up to this time has been indexed
+    indexed_until: Mapped[Optional[datetime]]
 
     @classmethod
     def unique_hash(cls, repo_id):
         return repo_id
 
-    # noinspection PyMethodOverriding
-    @classmethod
-    def unique_filter(cls, query, repo_id):
-        return query.filter(KnownRepo.repo_id == repo_id)
-
 
 class KnownFile(Base, UniqueMixin):
     __tablename__ = "known_files"
+    unique_keys = ("repo_id", "file_path")
 
     repo_id: Mapped[str] = mapped_column(ForeignKey("known_repos.repo_id"), primary_key=True)
     file_path: Mapped[str] = mapped_column(primary_key=True)
@@ -99,14 +112,13 @@ class KnownFile(Base, UniqueMixin):
     def unique_hash(cls, repo_id, file_path):
         return f"{repo_id}@{file_path}"
 
-    # noinspection PyMethodOverriding
-    @classmethod
-    def unique_filter(cls, query, repo_id, file_path):
-        return query.filter(KnownFile.repo_id == repo_id).filter(KnownFile.file_path == file_path)
-
 
 class KnownPullRequest(Base, UniqueMixin):
     __tablename__ = "known_pull_requests"
+    __table_args__ = (
+        Index("ix_known_pull_requests_repo_id_merged_at", "repo_id", "merged_at"),
+    )
+    unique_keys = ("pull_request_id", "repo_id")
 
     pull_request_id: Mapped[int] = mapped_column(primary_key=True)
     repo_id: Mapped[str] = mapped_column(ForeignKey("known_repos.repo_id"), primary_key=True)
@@ -159,18 +171,21 @@ class KnownPullRequest(Base, UniqueMixin):
     def unique_hash(cls, pull_request_id, repo_id):
         return f"{repo_id}#{pull_request_id}"
 
-    # noinspection PyMethodOverriding
-    @classmethod
-    def unique_filter(cls, query, pull_request_id, repo_id):
-        return query.filter(KnownPullRequest.pull_request_id == pull_request_id).filter(KnownPullRequest.repo_id == repo_id)
-
 
 class KnownFileChange(Base, UniqueMixin):
     __tablename__ = "known_file_changes"
+    __table_args__ = (
+        # pull request numbers and file paths are only unique within a repo, so these must match the composite keys
+        ForeignKeyConstraint(["pull_request_id", "repo_id"], ["known_pull_requests.pull_request_id", "known_pull_requests.repo_id"]),
+        ForeignKeyConstraint(["file_path", "repo_id"], ["known_files.file_path", "known_files.repo_id"]),
+        Index("ix_known_file_changes_repo_id_file_path", "repo_id", "file_path"),
+        Index("ix_known_file_changes_repo_id_previous_file_path", "repo_id", "previous_file_path"),
+    )
+    unique_keys = ("pull_request_id", "repo_id", "file_path")
 
-    pull_request_id: Mapped[str] = mapped_column(ForeignKey("known_pull_requests.pull_request_id"), primary_key=True)
+    pull_request_id: Mapped[int] = mapped_column(primary_key=True)
     repo_id: Mapped[str] = mapped_column(ForeignKey("known_repos.repo_id"), primary_key=True)
-    file_path: Mapped[str] = mapped_column(ForeignKey("known_files.file_path"), primary_key=True)
+    file_path: Mapped[str] = mapped_column(primary_key=True)
 
     status: Mapped[str]
 
@@ -185,27 +200,35 @@ class KnownFileChange(Base, UniqueMixin):
     pull_request: Mapped[KnownPullRequest] = relationship()
 
     def update(self, file: github.File.File,):
-        self.file_path = file.filename
-        self.status = file.status
-        self.additions = file.additions
-        self.changes = file.changes
-        self.deletions = file.deletions
-        self.previous_file_path = file.previous_filename
-        self.patch = file.patch
-        self.sha = file.sha
+        for key, value in KnownFileChange.values_from(file).items():
+            setattr(self, key, value)
+
+    @staticmethod
+    def values_from(file: github.File.File) -> dict:
+        """
+        Returns the column values for a changed file, for use in bulk inserts.
+        :param file:
+        :return:
+        """
+        return {
+            "file_path": file.filename,
+            "status": file.status,
+            "additions": file.additions,
+            "changes": file.changes,
+            "deletions": file.deletions,
+            "previous_file_path": file.previous_filename,
+            "patch": file.patch,
+            "sha": file.sha,
+        }
 
     @classmethod
     def unique_hash(cls, pull_request_id, repo_id, file_path):
         return f"{repo_id}#{pull_request_id}:{file_path}"
 
-    # noinspection PyMethodOverriding
-    @classmethod
-    def unique_filter(cls, query, pull_request_id, repo_id, file_path):
-        return query.filter(KnownFileChange.pull_request_id == pull_request_id).filter(KnownFileChange.repo_id == repo_id).filter(KnownFileChange.file_path == file_path)
-
 
 class ProjectLatestAddition(Base, UniqueMixin):
     __tablename__ = "project_latest_addition"
+    unique_keys = ("branch",)
 
     branch: Mapped[str] = mapped_column(primary_key=True)
     pull_request_id: Mapped[str]
@@ -213,8 +236,3 @@ class ProjectLatestAddition(Base, UniqueMixin):
     @classmethod
     def unique_hash(cls, branch: str):
         return f"project_latest_addition/{branch}"
-
-    # noinspection PyMethodOverriding
-    @classmethod
-    def unique_filter(cls, query, branch: str):
-        return query.filter(ProjectLatestAddition.branch == branch)
@@ -1,26 +1,36 @@
 import asyncio
 import logging
 import time
+from datetime import datetime
 from enum import Enum
-from typing import Optional
+from typing import Iterator, Optional
 
 import discord
 import sqlalchemy
-from github import Github, Auth, UnknownObjectException
-from sqlalchemy.orm import Session
+from github import Github, Auth
+from github.File import File
+from github.PullRequest import PullRequest
+from github.Repository import Repository
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session, aliased, raiseload
 
 from src.model import KnownPullRequest, KnownRepo, KnownFile, KnownFileChange, ProjectLatestAddition
 from .git import LocalRepo, RepoId, PullRequestId, MergeConflictsException
 from .pubsub import Publisher, MessageEvent
 from .status import StatusMessage
 from .ui.pages import MergeConflictsPaginator
-from .utils import qualify_implicit_issues, parse_pull_request_urls, pretty_duration
+from .utils import qualify_implicit_issues, parse_pull_request_urls, pretty_duration, ExpiringCache
 
 log = logging.getLogger(__name__)
 
 
 HOME_REPO_ID = RepoId("teamstarcup", "starcup")
 
+# pull requests changing this file are merges from upstream
+UPSTREAM_MERGE_FILE_PATH = "Resources/Changelog/Changelog.yml"
+# the largest page size GitHub allows
+GITHUB_PAGE_SIZE = 100
+
 
 class PortingMethod(Enum):
     PATCH = 0,
@@ -42,6 +52,11 @@ class Project:
 
         self.status_message = StatusMessage(thread)
         self._benchmark_start = None
+        self._github_username: Optional[str] = None
+        # a project only lives for one port, so GitHub objects are fetched at most once per project
+        self._github_repos: dict[str, Repository] = {}
+        self._pull_requests: dict[str, PullRequest] = {}
+        self._initial_pull_request_id: Optional[PullRequestId] = None
 
     def __enter__(self):
         self.publisher.subscribe(self.status_message)
@@ -67,15 +82,25 @@ class Project:
             self.initial_pull_request_opened = True
             self.latest_pull_request_id = PullRequestId.from_string(latest_pull_request_id)
 
+    # PyGithub blocks on HTTP requests, so calls to it are made on worker threads to keep the event loop responsive
+
     async def _get_github_repo(self, repo_id: RepoId):
-        return self.github.get_repo(str(repo_id))
+        key = str(repo_id)
+        if key not in self._github_repos:
+            self._github_repos[key] = await asyncio.to_thread(self.github.get_repo, key)
+        return self._github_repos[key]
 
     async def _get_pull_request(self, pull_request_id: PullRequestId):
-        repo = await self._get_github_repo(pull_request_id.repo_id())
-        return repo.get_pull(pull_request_id.number)
+        key = str(pull_request_id)
+        if key not in self._pull_requests:
+            repo = await self._get_github_repo(pull_request_id.repo_id())
+            self._pull_requests[key] = await asyncio.to_thread(repo.get_pull, pull_request_id.number)
+        return self._pull_requests[key]
 
     async def _get_github_username(self):
-        return self.github.get_user().login
+        if self._github_username is None:
+            self._github_username = await asyncio.to_thread(lambda: self.github.get_user().login)
+        return self._github_username
 
     async def _get_github_token(self):
         return self.github
@@ -85,9 +110,11 @@ class Project:
         Returns the initial pull request which was ported in this project.
         :return:
         """
-        original_message = await self.thread.parent.fetch_message(self.thread.id)
-        pull_request_id = parse_pull_request_urls(original_message.content).pop()
-        return pull_request_id
+        # the starter message never changes, so it is only fetched once
+        if self._initial_pull_request_id is None:
+            original_message = await self.thread.parent.fetch_message(self.thread.id)
+            self._initial_pull_request_id = parse_pull_request_urls(original_message.content).pop()
+        return self._initial_pull_request_id
 
     async def prepare_repo(self, token: str):
         """
@@ -95,27 +122,29 @@ class Project:
         merging state and updates the access token in the remote tracking url.
 
         - clears previous merge resolution state
-        - fetches remote ``origin``, checks out ``main``, and resets ``HEAD`` to ``origin/HEAD``
         - updates tracking url for remote ``origin`` to use the provided token
         - tracks ``teamstarcup/starcup`` as ``teamstarcup-starcup``
-        - fetches remote ``teamstarcup-starcup``, checks out ``main``, and resets ``HEAD`` to ``teamstarcup-starcup/HEAD``
-        - pushes ``main`` to ``origin/main``
+        - fetches remotes ``origin`` and ``teamstarcup-starcup`` in parallel within a single git process
+        - checks out ``main`` and resets ``HEAD`` to ``origin/HEAD``
+        - checks out ``main`` and resets ``HEAD`` to ``teamstarcup-starcup/HEAD``
 
         :param token:
         :return:
         """
         await self.work_repo.reset_hard("HEAD")  # clear any previous bad state
-        await self.work_repo.sync_branch_with_remote("origin", await self.work_repo.default_branch())
 
+        # both of these write .git/config, which git refuses to do concurrently
         remote_url = await self.work_repo.get_remote_url("origin")
         if token not in remote_url:
-            remote_url = remote_url.replace("://github.com", f"://{self._get_github_username()}:{token}@github.com")
+            remote_url = remote_url.replace("://github.com", f"://{await self._get_github_username()}:{token}@github.com")
             await self.work_repo.set_remote_url("origin", remote_url)
-
         await self.work_repo.track_remote(HOME_REPO_ID)
 
+        await self.work_repo.fetch("origin", HOME_REPO_ID)
+
+        await self.work_repo.reset_branch_to_remote("origin", await self.work_repo.default_branch())
         default_branch = await self.work_repo.default_branch(HOME_REPO_ID)
-        await self.work_repo.sync_branch_with_remote(HOME_REPO_ID.slug(), default_branch)
+        await self.work_repo.reset_branch_to_remote(HOME_REPO_ID.slug(), default_branch)
 
     async def _get_project_state(self):
         """
@@ -126,24 +155,24 @@ class Project:
         project_latest_addition = ProjectLatestAddition.as_unique(self.session, branch)
         return project_latest_addition
 
-    async def _select_porting_method(self, pull_request_id: PullRequestId):
+    async def _select_porting_method(self, target_pull_request: PullRequest):
         """
         Determines the method for porting a pull request.
 
         Pull requests that end in a commit with one parent will be cherry-picked.
         Commits with multiple parents and unmerged pull requests are trickier, so we want to grab the
         patch files for every commit in that branch to apply them one at a time.
-        :param pull_request_id:
+
+        The pull request's remote must already be fetched into the work repo.
+        :param target_pull_request:
         :return:
         """
-        target_pull_request = await self._get_pull_request(pull_request_id)
-
-        if not target_pull_request.is_merged():
+        # already part of the fetched pull request, unlike is_merged() which asks GitHub again
+        if not target_pull_request.merged:
             return PortingMethod.PATCH
 
-        target_repo_github = await self._get_github_repo(pull_request_id.repo_id())
-        target_commit = target_repo_github.get_commit(target_pull_request.merge_commit_sha).commit
-        if len(target_commit.parents) > 1:
+        # the target remote has already been fetched, so the merge commit can be inspected locally
+        if await self.work_repo.parent_count(target_pull_request.merge_commit_sha) > 1:
             return PortingMethod.PATCH
 
         return PortingMethod.CHERRY_PICK
@@ -204,7 +233,7 @@ class Project:
         # if rename_info: rename file
         # if any files were renamed, stage files and author a commit
 
-        method = await self._select_porting_method(pull_request_id)
+        method = await self._select_porting_method(target_pull_request)
         if method == PortingMethod.PATCH:
             await self.work_repo.apply_patch_from_url_conflict_resolving(target_pull_request.patch_url)
         else:
@@ -253,15 +282,11 @@ class Project:
 
     async def create_pull_request(self, title: str, pull_request_id: PullRequestId, draft: bool = False):
         target_pull_request = await self._get_pull_request(pull_request_id)
-        body = f"Port of {target_pull_request}"
-        body += "\n\n"
-        body += "## Quote\n"
-        body += target_pull_request.body
-
-        body = qualify_implicit_issues(body, pull_request_id.repo_id())
+        body = qualify_implicit_issues(f"Port of {target_pull_request}\n\n## Quote\n{target_pull_request.body or ''}", pull_request_id.repo_id())
 
         home_repo_github = await self._get_github_repo(HOME_REPO_ID)
-        new_pull_request = home_repo_github.create_pull(
+        new_pull_request = await asyncio.to_thread(
+            home_repo_github.create_pull,
             await self.work_repo.default_branch(HOME_REPO_ID),
             f"{await self._get_github_username()}:{self.branch}",
             body=body,
@@ -276,106 +301,239 @@ class Project:
 class Morticia:
     def __init__(self, auth_token: str, session: Session):
         self.auth = Auth.Token(auth_token)
-        self.github = Github(auth=self.auth)
+        # the largest page size, so paginated lists such as changed files need fewer requests
+        # the connection pool has room for every indexing worker plus other commands, so kept-alive TLS
+        # connections are reused instead of being discarded and renegotiated
+        self.github = Github(auth=self.auth, per_page=GITHUB_PAGE_SIZE, pool_size=Morticia.INDEX_CONCURRENCY * 2)
         self.session = session
         self.home_repo_id = RepoId("teamstarcup", "starcup")
         self.work_repo_id = RepoId("teamstarcup-bot", "starcup")
 
+        self._github_repos = ExpiringCache(ttl=300, maxsize=64)
+        self._pull_requests = ExpiringCache(ttl=60, maxsize=256)
+        # each entry holds every changed file's patch, so only a handful are kept
+        self._pull_requests_with_files = ExpiringCache(ttl=300, maxsize=32)
+        self._history_links = ExpiringCache(ttl=3600, maxsize=256)
+        sqlalchemy.event.listen(self.session, "after_commit", self._clear_index_caches)
+
+    def _clear_index_caches(self, _session: Session):
+        # newly indexed pull requests may be ancestors or descendants
+        self._history_links.clear()
+
     def close(self) -> None:
         self.github.close()
 
     def get_github_repo(self, repo_id: RepoId):
-        return self.github.get_repo(str(repo_id))
+        repo_id_str = str(repo_id)
+        repo = self._github_repos.get(repo_id_str)
+        if repo is None:
+            repo = self.github.get_repo(repo_id_str)
+            self._github_repos.set(repo_id_str, repo)
+        return repo
 
     def get_pull_request(self, pr_id: PullRequestId):
-        repo = self.get_github_repo(pr_id.repo_id())
-        return repo.get_pull(pr_id.number)
+        key = str(pr_id)
+        pull_request = self._pull_requests.get(key)
+        if pull_request is None:
+            repo = self.get_github_repo(pr_id.repo_id())
+            pull_request = repo.get_pull(pr_id.number)
+            self._pull_requests.set(key, pull_request)
+        return pull_request
+
+    def _commit_index(self):
+        """
+        Commits indexing progress without waiting for Postgres to flush the WAL to disk. A crash can only lose the
+        last few commits, never corrupt the database, and anything lost is simply fetched again on the next index.
+        :return:
+        """
+        self.session.execute(sqlalchemy.text("SET LOCAL synchronous_commit TO OFF"))
+        self.session.commit()
+        # committed rows can be found by querying again, so don't keep every indexed pull request alive
+        self.session.info.pop("_unique_cache", None)
 
-    async def index_repo(self, repo_id: RepoId):
-        repo = self.get_github_repo(repo_id)
+    # pull requests completed from GitHub at once while indexing
+    INDEX_CONCURRENCY = 8
+    # changed files written per statement
+    INDEX_UPSERT_CHUNK_SIZE = 200
+    # requests left in the rate limit window below which indexing waits for it to reset
+    INDEX_RATE_LIMIT_RESERVE = 500
 
-        # make sure this was inserted because foreignkey depends on it
-        KnownRepo.as_unique(self.session, repo_id=str(repo_id))
-        self.session.commit()
+    async def _wait_for_rate_limit(self):
+        """
+        Sleeps until GitHub's rate limit resets if indexing has nearly used it up, so that requests from other
+        commands still succeed. The remaining count comes from the headers of the last response.
+        :return:
+        """
+        remaining, _ = await asyncio.to_thread(lambda: self.github.rate_limiting)
+        if remaining > Morticia.INDEX_RATE_LIMIT_RESERVE:
+            return
 
-        highest_pull_request_id = repo.get_pulls(state="all", direction="desc").get_page(0)[0].number
-        for i in range(highest_pull_request_id, 1, -1):
-            # if self.session.execute(sqlalchemy.select(KnownPullRequest).where(KnownPullRequest.pull_request_id == i and KnownPullRequest.repo_id == repo_id)).scalar():
-            #     continue
-            try:
-                pull_request = repo.get_pull(i)
-            except UnknownObjectException:
-                continue
+        reset_time = await asyncio.to_thread(lambda: self.github.rate_limiting_resettime)
+        delay = max(reset_time - time.time(), 0) + 1
+        log.info(f"{remaining} GitHub requests remaining, pausing indexing for {pretty_duration(int(delay))}")
+        await asyncio.sleep(delay)
 
-            known_pr = KnownPullRequest.as_unique(self.session, pull_request_id=pull_request.number, repo_id=str(repo_id))
-            known_pr.update(pull_request)
-            self.session.commit()
+    @staticmethod
+    async def _fetch_pull_request(pull_request: PullRequest, semaphore: asyncio.Semaphore):
+        """
+        Completes a listed pull request and fetches its changed files from GitHub on a worker thread.
+        :param pull_request: a pull request from a listing, which lacks details such as its changed file count
+        :param semaphore: bounds the number of requests in flight
+        :return: the pull request and its files
+        """
+        async with semaphore:
+            # reading a detail missing from the listing fetches the full pull request
+            changed_files = await asyncio.to_thread(lambda: pull_request.changed_files)
 
             # GitHub sends back an HTTP 422 error if we try to iterate changed files and there are none
-            if pull_request.changed_files == 0:
-                continue
+            if changed_files == 0:
+                return pull_request, []
+
+            # the number of pages is known up front, so large pull requests have theirs requested together
+            paginated_files = pull_request.get_files()
+            page_count = -(-changed_files // GITHUB_PAGE_SIZE)
+            pages = await asyncio.gather(*(asyncio.to_thread(paginated_files.get_page, i) for i in range(page_count)))
+            return pull_request, [file for page in pages for file in page]
+
+    def _upsert_file_changes(self, repo_id_str: str, pull_request_id: int, files: list[File]):
+        # make sure these were inserted because foreignkey depends on them
+        self.session.execute(
+            insert(KnownFile)
+            .values([{"repo_id": repo_id_str, "file_path": file.filename} for file in files])
+            .on_conflict_do_nothing()
+        )
 
-            for file in pull_request.get_files():
-                # make sure this was inserted because foreignkey depends on it
-                KnownFile.as_unique(self.session, repo_id=str(repo_id), file_path=file.filename)
+        rows = [
+            {"pull_request_id": pull_request_id, "repo_id": repo_id_str, **KnownFileChange.values_from(file)}
+            for file in files
+        ]
+        statement = insert(KnownFileChange).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=KnownFileChange.unique_keys,
+            set_={key: statement.excluded[key] for key in rows[0] if key not in KnownFileChange.unique_keys},
+        )
+        self.session.execute(statement)
 
-                known_file_change = KnownFileChange.as_unique(self.session, pull_request_id=pull_request.number, repo_id=str(repo_id), file_path=file.filename)
-                known_file_change.update(file)
-                # await asyncio.sleep(1)
+    def _index_pull_request(self, repo_id_str: str, pull_request: PullRequest, files: list[File]):
+        known_pr = KnownPullRequest.as_unique(self.session, pull_request_id=pull_request.number, repo_id=repo_id_str)
+        known_pr.update(pull_request)
+        # the file changes below reference this row
+        self.session.flush()
 
-            await asyncio.sleep(1)
+        # pull requests can change up to 3000 files, so their rows are written in bounded chunks
+        for start in range(0, len(files), Morticia.INDEX_UPSERT_CHUNK_SIZE):
+            self._upsert_file_changes(repo_id_str, pull_request.number, files[start:start + Morticia.INDEX_UPSERT_CHUNK_SIZE])
 
-            self.session.commit()
-            # break
+    def _known_updated_at(self, repo_id_str: str, pull_requests: list[PullRequest]) -> dict[int, Optional[datetime]]:
+        """
+        Returns when each of the given pull requests was last updated according to the index, by number.
+        :param repo_id_str:
+        :param pull_requests:
+        :return:
+        """
+        statement = sqlalchemy.select(KnownPullRequest.pull_request_id, KnownPullRequest.updated_at).where(
+            KnownPullRequest.repo_id == repo_id_str,
+            KnownPullRequest.pull_request_id.in_([pull_request.number for pull_request in pull_requests]),
+        )
+        return dict(self.session.execute(statement).tuples().all())
+
+    async def index_repo(self, repo_id: RepoId):
+        repo = await asyncio.to_thread(self.get_github_repo, repo_id)
 
-    def get_upstream_merge_prs(self, repo_id: Optional[RepoId] = None):
+        # make sure this was inserted because foreignkey depends on it
+        repo_id_str = str(repo_id)
+        known_repo = KnownRepo.as_unique(self.session, repo_id=repo_id_str)
+        self._commit_index()
+        indexed_until = known_repo.indexed_until
+        newest_updated_at = None
+
+        semaphore = asyncio.Semaphore(Morticia.INDEX_CONCURRENCY)
+        # listing skips the numbers taken by issues, which would otherwise each cost a 404
+        # most recently updated first, so a reindex can stop once it reaches what the last complete one saw
+        pulls = repo.get_pulls(state="all", sort="updated", direction="desc")
+        page_number = 0
+        reached_indexed = False
+        while not reached_indexed and (page := await asyncio.to_thread(pulls.get_page, page_number)):
+            newest_updated_at = newest_updated_at or page[0].updated_at.replace(tzinfo=None)
+            if indexed_until is not None:
+                reached_indexed = page[-1].updated_at.replace(tzinfo=None) <= indexed_until
+                page = [pull_request for pull_request in page if pull_request.updated_at.replace(tzinfo=None) > indexed_until]
+
+            # listings include when each pull request was last updated, so unchanged ones need no further requests
+            known_updated_at = self._known_updated_at(repo_id_str, page)
+            page = [
+                pull_request for pull_request in page
+                if known_updated_at.get(pull_request.number) != pull_request.updated_at.replace(tzinfo=None)
+            ]
+            results = await asyncio.gather(*(Morticia._fetch_pull_request(pull_request, semaphore) for pull_request in page))
+
+            # the session is not thread safe, so rows are written back on the event loop
+            for pull_request, files in results:
+                self._index_pull_request(repo_id_str, pull_request, files)
+            # one transaction per page of pull requests
+            self._commit_index()
+
+            page_number += 1
+            await self._wait_for_rate_limit()
+
+        # only recorded once every page has been indexed, so an interrupted index is picked up again in full
+        if newest_updated_at is not None:
+            known_repo.indexed_until = newest_updated_at
+            self._commit_index()
+
+    # rows fetched at a time when streaming large result sets
+    YIELD_PER = 1000
+
+    def get_upstream_merge_prs(self, repo_id: Optional[RepoId] = None) -> Iterator[KnownPullRequest]:
         """
-        Returns a list of KnownPullRequests, which are not necessarily merged.
+        Yields KnownPullRequests, which are not necessarily merged.
         :param repo_id:
         :return:
         """
-        statement = sqlalchemy.select(KnownFileChange, KnownPullRequest)
-        statement = statement.join(KnownPullRequest, KnownFileChange.pull_request)
-        statement = statement.where(KnownFileChange.file_path == "Resources/Changelog/Changelog.yml")
+        statement = sqlalchemy.select(KnownPullRequest).select_from(KnownFileChange).join(KnownFileChange.pull_request)
+        statement = statement.where(KnownFileChange.file_path == UPSTREAM_MERGE_FILE_PATH)
         if repo_id is not None:
             statement = statement.filter(KnownFileChange.repo_id == str(repo_id))
-            statement = statement.filter(KnownPullRequest.repo_id == str(repo_id))
-        print(statement)
-        known_file_changes = self.session.execute(statement).scalars().all()
-        return list(map(lambda change: change.pull_request, known_file_changes))
+        statement = statement.execution_options(yield_per=Morticia.YIELD_PER)
+        yield from self.session.execute(statement).scalars()
+
+    @staticmethod
+    def _is_upstream_merge():
+        """
+        Returns a condition matching KnownPullRequests which are upstream merges, for use in queries over them.
+        :return:
+        """
+        changelog_change = aliased(KnownFileChange)
+        return sqlalchemy.exists().where(
+            changelog_change.repo_id == KnownPullRequest.repo_id,
+            changelog_change.pull_request_id == KnownPullRequest.pull_request_id,
+            changelog_change.file_path == UPSTREAM_MERGE_FILE_PATH,
+        )
 
-    def search_for_file_changes(self, path: str, repo_id: Optional[RepoId] = None, merged_only: bool = True, ignore_upstream_merges: bool = True):
+    def search_for_file_changes(self, path: str, repo_id: Optional[RepoId] = None, merged_only: bool = True, ignore_upstream_merges: bool = True) -> Iterator[KnownPullRequest]:
         """
-        Returns a list of KnownPullRequests that modify the given file path.
+        Yields KnownPullRequests that modify the given file path, oldest first. Unmerged pull requests are yielded
+        before all others.
         :param path: path to the file to search for changes
         :param repo_id: the repository, if any, to exclusively search for changes
         :param merged_only: ignore unmerged pull requests
         :param ignore_upstream_merges: ignore pull requests that modify ``Resources/Changelog/Changelog.yml``
         :return:
         """
-        statement = sqlalchemy.select(KnownFileChange, KnownPullRequest)
+        statement = sqlalchemy.select(KnownPullRequest).select_from(KnownFileChange).join(KnownFileChange.pull_request)
         statement = statement.filter(KnownFileChange.file_path == path)
         if repo_id is not None:
-            statement = statement.filter(KnownFileChange.repo_id == str(repo_id), KnownPullRequest.repo_id == str(repo_id))
+            statement = statement.filter(KnownFileChange.repo_id == str(repo_id))
         if merged_only:
             statement = statement.filter(KnownPullRequest.merged)
-        statement = statement.join(KnownPullRequest, KnownFileChange.pull_request)
-        print(statement)
-        known_file_changes = self.session.execute(statement).scalars().all()
-        pull_requests = list(map(lambda change: change.pull_request, known_file_changes))
-
         if ignore_upstream_merges:
-            upstream_merges = self.get_upstream_merge_prs(repo_id)
-            for upstream_merge in upstream_merges:
-                for pull_request in pull_requests:
-                    if pull_request.pull_request_id == upstream_merge.pull_request_id:
-                        pull_requests.remove(pull_request)
-                        break
-
-        return pull_requests
+            statement = statement.filter(~Morticia._is_upstream_merge())
+        statement = statement.order_by(KnownPullRequest.merged_at.nulls_first()).options(raiseload("*"))
+        statement = statement.execution_options(yield_per=Morticia.YIELD_PER)
+        yield from self.session.execute(statement).scalars()
 
 
-    HIGH_FREQUENCY_FILES = {
+    HIGH_FREQUENCY_FILES = frozenset({
         "Resources/Prototypes/Entities/Structures/Machines/lathe.yml",
         "Resources/Prototypes/tags.yml",
         "Resources/Prototypes/Loadouts/loadout_groups.yml",
@@ -383,121 +541,140 @@ class Morticia:
         "Resources/Prototypes/Entities/Objects/Fun/toys.yml",
         "Resources/Prototypes/Loadouts/Miscellaneous/trinkets.yml",
         "Resources/Prototypes/_Impstation/Loadouts/Miscellaneous/trinkets.yml",
-    }
+    })
 
-    def get_ancestors(self, pr_id: PullRequestId):
+    # file change statuses that make a pull request relevant to a file's history
+    ANCESTOR_STATUSES = frozenset({"modified", "changed", "renamed", "deleted"})
+    DESCENDANT_STATUSES = frozenset({"added"})
+
+    def _find_merged_pull_requests_changing(self, repo_id: RepoId, file_paths: set[str], *criteria):
         """
-        Search for a list of ancestor PRs for the given pull request.
-        :param pr_id:
+        Returns merged KnownPullRequests, oldest first, that changed or renamed any of the given file paths.
+        Upstream merges are excluded.
+        :param repo_id: the repository to search
+        :param file_paths: paths to search for changes
+        :param criteria: extra conditions on KnownPullRequest
         :return:
         """
-        median_pr = self.get_pull_request(pr_id)
-        repo_id = pr_id.repo_id()
+        # e.g. every changed file is a high frequency file, which nothing useful can be learned from
+        if not file_paths:
+            return []
+
+        # a semi-join yields each pull request once, without deduplicating whole rows afterwards
+        changes_file = sqlalchemy.exists().where(
+            KnownFileChange.repo_id == KnownPullRequest.repo_id,
+            KnownFileChange.pull_request_id == KnownPullRequest.pull_request_id,
+            KnownFileChange.file_path.in_(file_paths) | KnownFileChange.previous_file_path.in_(file_paths),
+        )
+        statement = (
+            sqlalchemy.select(KnownPullRequest)
+            .where(
+                KnownPullRequest.repo_id == str(repo_id),
+                changes_file,
+                KnownPullRequest.merged,
+                ~Morticia._is_upstream_merge(),
+                *criteria,
+            )
+            .order_by(KnownPullRequest.merged_at)
+            # only columns are read from the results, so any lazy load would be a regression
+            .options(raiseload("*"))
+        )
+        return self.session.execute(statement).scalars().all()
 
-        # gather list of files to search history
-        relevant_file_paths: set[str] = set()
-        for file in median_pr.get_files():
-            if file.filename in Morticia.HIGH_FREQUENCY_FILES:
-                continue
-            match file.status:
-                case "modified" | "changed" | "renamed" | "deleted":
-                    relevant_file_paths.add(file.filename)
+    @staticmethod
+    def _pull_request_time(pull_request: PullRequest) -> datetime:
+        """
+        Returns when a pull request was merged, or when it was opened if it hasn't been, as a naive UTC datetime
+        comparable with those stored in the database.
+        :param pull_request:
+        :return:
+        """
+        merged_at = pull_request.merged_at if pull_request.merged else None
+        pull_request_time = merged_at if merged_at is not None else pull_request.created_at
+        return pull_request_time.replace(tzinfo=None)
 
-        # used for filtering ancestor PRs
-        median_pr_time = median_pr.merged and median_pr.merged_at or median_pr.created_at
-        median_pr_time = median_pr_time.replace(tzinfo=None)
-
-        known_upstream_merges = self.get_upstream_merge_prs(repo_id)
-
-        ancestors: set[KnownPullRequest] = set()
-        for relevant_file_path in relevant_file_paths:
-            known_file_changes = self.session.execute(
-                sqlalchemy.select(KnownFileChange)
-                .where(KnownFileChange.repo_id == str(repo_id))
-                .filter(
-                    ((KnownFileChange.file_path == relevant_file_path) | (KnownFileChange.previous_file_path == relevant_file_path))
-                )
-            )
+    def _get_pull_request_with_files(self, pr_id: PullRequestId) -> tuple[PullRequest, list[File]]:
+        """
+        Fetches a pull request and its changed files. The pull request itself is always fetched fresh, but its files
+        are reused while it hasn't been updated, so that searching for both the ancestors and descendants of a pull
+        request only lists them once.
+        :param pr_id:
+        :return:
+        """
+        key = str(pr_id)
+        pull_request = self.get_github_repo(pr_id.repo_id()).get_pull(pr_id.number)
+        self._pull_requests.set(key, pull_request)
 
-            for known_file_change in known_file_changes.scalars():
-                known_pull_request = self.session.execute(sqlalchemy.select(KnownPullRequest).filter((KnownPullRequest.repo_id == str(repo_id)) & (KnownPullRequest.pull_request_id == known_file_change.pull_request_id))).scalar()
+        cached = self._pull_requests_with_files.get(key)
+        if cached is not None and cached[0].updated_at == pull_request.updated_at:
+            return pull_request, cached[1]
 
-                if not known_pull_request.merged:
-                    continue
+        files = list(pull_request.get_files())
+        self._pull_requests_with_files.set(key, (pull_request, files))
+        return pull_request, files
 
-                if known_pull_request.merged_at >= median_pr_time:
-                    continue
+    async def get_ancestors(self, pr_id: PullRequestId):
+        """
+        Search for a list of ancestor PRs for the given pull request.
+        :param pr_id:
+        :return:
+        """
+        median_pr, files = await asyncio.to_thread(self._get_pull_request_with_files, pr_id)
+        repo_id = pr_id.repo_id()
 
-                if known_pull_request in known_upstream_merges:
-                    continue
+        # results only change when the pull request is updated or more pull requests are indexed
+        key = ("ancestors", str(pr_id), median_pr.updated_at)
+        if (ancestor_links := self._history_links.get(key)) is not None:
+            return ancestor_links
+
+        # gather list of files to search history
+        relevant_file_paths: set[str] = {
+            file.filename for file in files
+            if file.status in Morticia.ANCESTOR_STATUSES and file.filename not in Morticia.HIGH_FREQUENCY_FILES
+        }
 
-                ancestors.add(known_pull_request)
+        # used for filtering ancestor PRs
+        median_pr_time = Morticia._pull_request_time(median_pr)
 
-        def sort_by_oldest(element: KnownPullRequest):
-            return element.merged_at
-        ancestors: list[KnownPullRequest] = list(ancestors)
-        ancestors.sort(key=sort_by_oldest)
+        ancestors = self._find_merged_pull_requests_changing(
+            repo_id, relevant_file_paths, KnownPullRequest.merged_at < median_pr_time
+        )
 
         ancestor_links = []
         for ancestor in ancestors:
             ancestor_links.append(f"#{ancestor.pull_request_id} - {ancestor.title}")
 
+        self._history_links.set(key, ancestor_links)
         return ancestor_links
 
-    def get_descendants(self, pr_id: PullRequestId):
+    async def get_descendants(self, pr_id: PullRequestId):
         """
         Search for a list of descendant PRs for the given pull request.
         :param pr_id:
         :return:
         """
-        median_pr = self.get_pull_request(pr_id)
+        median_pr, files = await asyncio.to_thread(self._get_pull_request_with_files, pr_id)
         repo_id = pr_id.repo_id()
 
-        # gather list of files to search history
-        relevant_file_paths: set[str] = set()
-        for file in median_pr.get_files():
-            match file.status:
-                case "added":
-                    relevant_file_paths.add(file.filename)
-
-        median_pr_time = median_pr.merged and median_pr.merged_at or median_pr.created_at
-        median_pr_time = median_pr_time.replace(tzinfo=None)
-
-        known_upstream_merges = self.get_upstream_merge_prs(repo_id)
-
-        descendants: set[KnownPullRequest] = set()
-        for relevant_file_path in relevant_file_paths:
-            known_file_changes = self.session.execute(
-                sqlalchemy.select(KnownFileChange)
-                .where(KnownFileChange.repo_id == str(repo_id))
-                .filter(
-                    ((KnownFileChange.file_path == relevant_file_path) | (KnownFileChange.previous_file_path == relevant_file_path))
-                )
-            )
-
-            for known_file_change in known_file_changes.scalars():
-                known_pull_request = self.session.execute(sqlalchemy.select(KnownPullRequest).filter((KnownPullRequest.repo_id == str(repo_id)) & (KnownPullRequest.pull_request_id == known_file_change.pull_request_id))).scalar()
+        # results only change when the pull request is updated or more pull requests are indexed
+        key = ("descendants", str(pr_id), median_pr.updated_at)
+        if (descendant_links := self._history_links.get(key)) is not None:
+            return descendant_links
 
-                if not known_pull_request.merged:
-                    continue
-
-                if known_pull_request.merged_at <= median_pr_time:
-                    continue
-
-                if known_pull_request in known_upstream_merges:
-                    continue
+        # gather list of files to search history
+        relevant_file_paths: set[str] = {file.filename for file in files if file.status in Morticia.DESCENDANT_STATUSES}
 
-                descendants.add(known_pull_request)
+        median_pr_time = Morticia._pull_request_time(median_pr)
 
-        def sort_by_oldest(element: KnownPullRequest):
-            return element.merged_at
-        descendants: list[KnownPullRequest] = list(descendants)
-        descendants.sort(key=sort_by_oldest)
+        descendants = self._find_merged_pull_requests_changing(
+            repo_id, relevant_file_paths, KnownPullRequest.merged_at > median_pr_time
+        )
 
         descendant_links = []
         for descendant in descendants:
             descendant_links.append(f"#{descendant.pull_request_id} - {descendant.title}")
 
+        self._history_links.set(key, descendant_links)
         return descendant_links
 
     def eventual_file_name(self, file_path: str, repo_id: RepoId):
@@ -507,6 +684,5 @@ class Morticia:
         :param repo_id:
         :return:
         """
-        statement = sqlalchemy.select(KnownFileChange).where(KnownFileChange.repo_id == str(repo_id), KnownFileChange.previous_file_path == file_path)
-        known_file_change: KnownFileChange = self.session.execute(statement).scalar()
-        return known_file_change and known_file_change.file_path or None
+        statement = sqlalchemy.select(KnownFileChange.file_path).where(KnownFileChange.repo_id == str(repo_id), KnownFileChange.previous_file_path == file_path)
+        return self.session.execute(statement.limit(1)).scalar_one_or_none()
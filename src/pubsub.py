@@ -1,4 +1,5 @@
 import inspect
+from collections import defaultdict
 from typing import Callable, Any, Coroutine
 
 
@@ -16,31 +17,48 @@ class MessageEvent(BaseEvent):
         self.message = message
 
 
+# (event type, method name) of each receive_ method, by subscriber class
+_handler_cache: dict[type, list[tuple[type, str]]] = {}
+
+
+def _handlers(subscriber_type: type) -> list[tuple[type, str]]:
+    handlers = _handler_cache.get(subscriber_type)
+    if handlers is None:
+        handlers = []
+        for method_name in dir(subscriber_type):
+            if not method_name.startswith("receive_"):
+                continue
+            method = getattr(subscriber_type, method_name)
+            if not callable(method):
+                continue
+            event_type = inspect.signature(method).parameters["event"].annotation
+            handlers.append((event_type, method_name))
+        _handler_cache[subscriber_type] = handlers
+    return handlers
+
+
 class Publisher:
     def __init__(self):
-        self._subscriptions: set[tuple[type, Callable[[BaseEvent],Coroutine[Any,Any,None]]]] = set()
+        # handlers by the exact event type they receive, in subscription order
+        self._subscriptions: dict[type, list[Callable[[BaseEvent], Coroutine[Any, Any, None]]]] = defaultdict(list)
         self._subscribers: dict[Any, list[Any]] = {}
 
     def subscribe(self, subscriber: Any):
         subscriptions = self._subscribers.get(subscriber, [])
-        method_names = [method_name for method_name in dir(subscriber) if callable(getattr(subscriber, method_name))]
-        for method_name in method_names:
-            if not method_name.startswith("receive_"):
+        for event_type, method_name in _handlers(type(subscriber)):
+            subscription = (event_type, getattr(subscriber, method_name))
+            if subscription in subscriptions:
                 continue
-            method = getattr(subscriber, method_name)
-            event_type = inspect.signature(method).parameters["event"].annotation
-            subscription = (event_type, method)
-            self._subscriptions.add(subscription)
+            self._subscriptions[event_type].append(subscription[1])
             subscriptions.append(subscription)
         self._subscribers[subscriber] = subscriptions
 
     def unsubscribe(self, subscriber: Any):
-        subscriptions = self._subscribers[subscriber]
-        for subscription in subscriptions:
-            self._subscriptions.remove(subscription)
+        subscriptions = self._subscribers.pop(subscriber)
+        for event_type, method in subscriptions:
+            self._subscriptions[event_type].remove(method)
 
     async def publish(self, event: BaseEvent):
-        info = [meta for meta in self._subscriptions if meta[0] == type(event)]
-        for entry in info:
-            _, subscription = entry
+        # handlers run one after another, so subscribers see events in the order they were published
+        for subscription in self._subscriptions.get(type(event), ()):
             await subscription(event)
@@ -1,5 +1,6 @@
+import asyncio
+import functools
 import os
-import time
 from enum import Enum
 
 from discord import Interaction
@@ -9,7 +10,13 @@ from src.pubsub import MessageEvent
 
 MAX_MESSAGE_LENGTH = 2000
 FORMATTING_CHARS_LENGTH = 12
+MESSAGE_PREFIX = "```ansi\n"
+MESSAGE_SUFFIX = "```"
 SPINNER_STATES = 4
+# the completed state first, followed by each spinning state
+SPINNER_CHARS = ("✓", "/", "-", "\\", "|")
+
+GITHUB_TOKEN = os.environ.get("GITHUB_TOKEN")
 
 MAGIC_RUNES_CMD = "[0;2m[0;36m$[0m"
 MAGIC_RUNES_INFO_START = "[0;2m[0;30m"
@@ -24,88 +31,123 @@ class Format(Enum):
     ERROR = 3
 
 
+# text around a line in each format
+FORMAT_AFFIXES = {
+    Format.STANDARD: ("", ""),
+    Format.COMMAND: (f"{MAGIC_RUNES_CMD} ", ""),
+    Format.COMMENT: (f"{MAGIC_RUNES_INFO_START}// ", MAGIC_RUNES_INFO_STOP),
+    Format.ERROR: (f"{MAGIC_RUNES_ERROR} ", ""),
+}
+# the format for each MessageEvent title
+EVENT_FORMATS = {
+    "standard": Format.STANDARD,
+    "command": Format.COMMAND,
+    "comment": Format.COMMENT,
+    "error": Format.ERROR,
+}
+
+
 class StatusMessage:
     def __init__(self, target: Messageable | Interaction):
         super().__init__()
         self.target = target
-        self.buffered_text = ""
+        # the target never changes, so neither does where new messages are sent
+        self._send = isinstance(target, Interaction) and target.channel.send or target.send
+        # pieces of the current message's text, joined when it is sent
+        self._buffer: list[str] = []
+        self._buffered_length = 0
         self.next_message = True
         self.message = None
 
-        self._last_flush = 0
+        # event loop time, which is monotonic unlike time.time()
+        self._last_flush = float("-inf")
         self._flush_time = 0.5
+        self._pending_flush: asyncio.Task | None = None
+        self._flush_lock = asyncio.Lock()
 
     async def receive_message(self, event: MessageEvent):
-        func = self.write_line
-        match event.title:
-            case "standard":
-                func = self.write_line
-            case "command":
-                func = self.write_command
-            case "comment":
-                func = self.write_comment
-            case "error":
-                func = self.write_error
-        await func(event.message)
+        await self.write_line(event.message, EVENT_FORMATS.get(event.title, Format.STANDARD))
 
     async def write(self, message: str) -> None:
-        message = message.replace(os.environ.get("GITHUB_TOKEN"), "<REDACTED>")
-        remaining_length = MAX_MESSAGE_LENGTH - FORMATTING_CHARS_LENGTH - len(self.buffered_text)
+        if GITHUB_TOKEN:
+            message = message.replace(GITHUB_TOKEN, "<REDACTED>")
+        remaining_length = MAX_MESSAGE_LENGTH - FORMATTING_CHARS_LENGTH - self._buffered_length
         if remaining_length - len(message) <= 0:
             self.next_message = True
-            self.buffered_text = ""
+            self._set_buffered_text("")
 
         while len(message) + FORMATTING_CHARS_LENGTH > MAX_MESSAGE_LENGTH:
             message_slice = message[:MAX_MESSAGE_LENGTH - FORMATTING_CHARS_LENGTH]
             message = message[MAX_MESSAGE_LENGTH - FORMATTING_CHARS_LENGTH:]
-            self.buffered_text = message_slice
+            self._set_buffered_text(message_slice)
             await self.flush()
             self.next_message = True
-            self.buffered_text = ""
+            self._set_buffered_text("")
+
+        self._buffer.append(message)
+        self._buffered_length += len(message)
 
-        self.buffered_text += message
+    @property
+    def buffered_text(self) -> str:
+        return "".join(self._buffer)
+
+    def _set_buffered_text(self, text: str) -> None:
+        self._buffer = text and [text] or []
+        self._buffered_length = len(text)
     
-    async def _periodic_flush(self):
-        if self._last_flush + self._flush_time < time.time():
+    async def request_flush(self):
+        """
+        Flushes now if the flush interval has passed, otherwise schedules a single flush for when it does.
+        :return:
+        """
+        if self._last_flush + self._flush_time < asyncio.get_running_loop().time():
             await self.flush()
+        elif self._pending_flush is None:
+            # everything written until the interval has passed goes out in one edit
+            self._pending_flush = asyncio.create_task(self._deferred_flush())
+
+    async def _deferred_flush(self):
+        await asyncio.sleep(self._last_flush + self._flush_time - asyncio.get_running_loop().time())
+        self._pending_flush = None
+        await self.flush()
 
     async def write_line(self, message: str, format: Format = Format.STANDARD):
-        match format:
-            case Format.COMMAND:
-                message = f"{MAGIC_RUNES_CMD} {message}"
-            case Format.COMMENT:
-                message = f"{MAGIC_RUNES_INFO_START}// {message}{MAGIC_RUNES_INFO_STOP}"
-            case Format.ERROR:
-                message = f"{MAGIC_RUNES_ERROR} {message}"
-        message += "\n"
-        await self.write(message)
-        await self._periodic_flush()
-
-    async def write_command(self, message: str):
-        await self.write_line(message, Format.COMMAND)
-
-    async def write_comment(self, message: str):
-        await self.write_line(message, Format.COMMENT)
-
-    async def write_error(self, message: str):
-        await self.write_line(message, Format.ERROR)
+        prefix, suffix = FORMAT_AFFIXES[format]
+        await self.write(f"{prefix}{message}{suffix}\n")
+        await self.request_flush()
+
+    write_command = functools.partialmethod(write_line, format=Format.COMMAND)
+    write_comment = functools.partialmethod(write_line, format=Format.COMMENT)
+    write_error = functools.partialmethod(write_line, format=Format.ERROR)
 
     async def rewrite_line(self, message: str) -> None:
-        self.buffered_text = self.buffered_text.rsplit("\n", 2)[0] + "\n"
+        # pieces written by write_line are whole lines, so the last one can usually be dropped on its own
+        last_piece = self._buffer and self._buffer[-1] or ""
+        is_whole_line = last_piece != "" and last_piece.find("\n") == len(last_piece) - 1
+        if is_whole_line and (len(self._buffer) == 1 or self._buffer[-2].endswith("\n")):
+            self._buffer.pop()
+            self._buffered_length -= len(last_piece)
+        else:
+            text = self.buffered_text
+            self._set_buffered_text(text[:text.rstrip("\n").rfind("\n") + 1])
         await self.write_line(message)
 
     async def flush(self) -> None:
-        content = f"```ansi\n{self.buffered_text}```"
-        if self.next_message:
-            if isinstance(self.target, Interaction):
-                self.message = await self.target.channel.send(content)
+        # the buffered text is about to be sent, so a deferred flush would only repeat it
+        if self._pending_flush is not None:
+            self._pending_flush.cancel()
+            self._pending_flush = None
+
+        async with self._flush_lock:
+            # joined straight into the message, rather than joining the text and copying it again
+            content = "".join((MESSAGE_PREFIX, *self._buffer, MESSAGE_SUFFIX))
+            if self.next_message:
+                self.message = await self._send(content)
+                self.next_message = False
             else:
-                self.message = await self.target.send(content)
-            self.next_message = False
-        else:
-            await self.message.edit(content=content)
+                await self.message.edit(content=content)
 
-        self._last_flush = time.time()
+            self._last_flush = asyncio.get_running_loop().time()
 
 
 class Spinner:
@@ -113,30 +155,24 @@ class Spinner:
         self.status = status
         self.text = text
         self.step = 1
-        self.has_written = False
+        # the first write adds the spinner's line, and every later one replaces it
+        self._write = self._write_first
 
-    async def _write(self, text: str) -> None:
-        method = self.has_written and self.status.rewrite_line or self.status.write_line
-        self.has_written = True
-        await method(text)
+    async def _write_first(self, text: str) -> None:
+        self._write = self.status.rewrite_line
+        await self.status.write_line(text)
 
-    async def spin(self):
-        char = ""
-        match self.step:
-            case 0:
-                char = "✓"
-            case 1:
-                char = "/"
-            case 2:
-                char = "-"
-            case 3:
-                char = "\\"
-            case 4:
-                char = "|"
+    async def _write_step(self):
+        char = SPINNER_CHARS[self.step]
         self.step = (self.step % SPINNER_STATES) + 1
         await self._write(f"[{char}] {self.text}")
-        await self.status.flush()
+
+    async def spin(self):
+        await self._write_step()
+        # ticks are coalesced with other writes instead of each editing the message
+        await self.status.request_flush()
 
     async def complete(self):
         self.step = 0
-        await self.spin()
+        await self._write_step()
+        await self.status.flush()
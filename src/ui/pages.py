@@ -14,28 +14,47 @@ from src.utils import temporary_file
 class MergeConflictsContext:
     def __init__(self, conflicts: list[MergeConflict], future: Optional[Future], refresh_callback: Callable[[], Coroutine[Any, Any, None]]):
         self.conflicts = conflicts
-        self.future = future
+        self._future = future
         self.refresh_callback = refresh_callback
+        self._remaining_conflicts = sum(1 for conflict in conflicts if conflict.resolution == ResolutionType.UNSELECTED)
+        self._progress_label = self._format_progress()
+
+    @property
+    def future(self) -> Future:
+        """
+        The future resolved once the merge is continued or cancelled, created on first use.
+        :return:
+        """
+        if self._future is None:
+            self._future = asyncio.get_running_loop().create_future()
+        return self._future
 
     def num_remaining_conflicts(self) -> int:
         """
         Returns the number of conflicts that have yet to be decided.
         :return:
         """
-        tally = 0
-        for conflict in self.conflicts:
-            if conflict.resolution != ResolutionType.UNSELECTED:
-                continue
-            tally += 1
-        return tally
+        return self._remaining_conflicts
+
+    def mark_decided(self, conflict: MergeConflict):
+        """
+        Records that a conflict is being decided. Must be called before its resolution is changed.
+        :param conflict:
+        :return:
+        """
+        if conflict.resolution == ResolutionType.UNSELECTED:
+            self._remaining_conflicts -= 1
+            self._progress_label = self._format_progress()
+
+    def _format_progress(self) -> str:
+        total_conflicts = len(self.conflicts)
+        return f"Progress: {total_conflicts - self._remaining_conflicts}/{total_conflicts}"
 
     async def refresh_page(self):
         await self.refresh_callback()
 
     def update_indicator_button(self, button: discord.ui.Button):
-        total_conflicts = len(self.conflicts)
-        remaining_conflicts = self.num_remaining_conflicts()
-        button.label = f"Progress: {total_conflicts - remaining_conflicts}/{total_conflicts}"
+        button.label = self._progress_label
 
     def update_continue_button(self, button: discord.ui.Button):
         button.disabled = self.num_remaining_conflicts() > 0
@@ -125,14 +144,16 @@ class MergeConflictView(discord.ui.View):
         self.add_item(self.continue_button)
 
         self.checked_button: Optional[discord.Button] = None
+        self._marked_button: Optional[discord.Button] = None
         self.refreshing = False
 
     async def update_buttons(self):
-        for child in self.children:
-            if child == self.checked_button:
-                child.emoji = "✅"
-            else:
-                child.emoji = None
+        # only the previously and newly checked buttons can have changed
+        if self._marked_button is not None and self._marked_button is not self.checked_button:
+            self._marked_button.emoji = None
+        if self.checked_button is not None:
+            self.checked_button.emoji = "✅"
+        self._marked_button = self.checked_button
 
         self.ctx.update_indicator_button(self.indicator_button)
         self.ctx.update_continue_button(self.continue_button)
@@ -144,6 +165,7 @@ class MergeConflictView(discord.ui.View):
     @discord.ui.button(label="Edit")
     async def edit(self, button: discord.Button, interaction: discord.Interaction):
         self.checked_button = button
+        self.ctx.mark_decided(self.conflict)
         self.conflict.take_manual()
         await interaction.response.send_modal(ResolveConflictModal(self.conflict))
         await self.update_buttons()
@@ -151,6 +173,7 @@ class MergeConflictView(discord.ui.View):
     @discord.ui.button(label="Ours")
     async def ours(self, button: discord.Button, interaction: discord.Interaction):
         self.checked_button = button
+        self.ctx.mark_decided(self.conflict)
         self.conflict.take_ours()
         await interaction.response.defer()
         await self.update_buttons()
@@ -158,6 +181,7 @@ class MergeConflictView(discord.ui.View):
     @discord.ui.button(label="Theirs")
     async def theirs(self, button: discord.Button, interaction: discord.Interaction):
         self.checked_button = button
+        self.ctx.mark_decided(self.conflict)
         self.conflict.take_theirs()
         await interaction.response.defer()
         await self.update_buttons()
@@ -165,6 +189,7 @@ class MergeConflictView(discord.ui.View):
     @discord.ui.button(label="Fix it later")
     async def fix_later(self, button: discord.Button, interaction: discord.Interaction):
         self.checked_button = button
+        self.ctx.mark_decided(self.conflict)
         self.conflict.as_is()
         await interaction.response.defer()
         await self.update_buttons()
@@ -183,20 +208,44 @@ class MergeConflictPage(discord.ext.pages.Page):
 
         diff = conflict.diff or f"Binary file"
 
-        # truncate lengthy diffs and upload them as attachments
-        files = []
+        # truncate lengthy diffs; the full diff is uploaded as an attachment once the page is shown
         if len(diff) > MAX_EMBED_LENGTH:
             diff = f"{diff[:4000]}\n\x1B[0m...\nTruncated diff"
-            file_name = f"{os.path.basename(conflict.path)}.diff.txt"
-            diff_output_file = temporary_file(conflict.diff, filename=file_name)
-            files.append(diff_output_file)
-
-        content_file = temporary_file(conflict.content, f"{os.path.basename(conflict.path)}")
-        files.append(content_file)
 
         desc = f"```ansi\n{diff}\n```"
         self.view = MergeConflictView(conflict, ctx)
-        super().__init__(embeds=[discord.Embed(title=f"{conflict.path}", description=desc)], custom_view=self.view, files=files, **kwargs)
+        self._files_created = False
+        super().__init__(embeds=[discord.Embed(title=f"{conflict.path}", description=desc)], custom_view=self.view, **kwargs)
+
+    def _create_files(self) -> list[discord.File]:
+        """
+        Builds this conflict's attachments as in-memory files.
+        :return: The full diff when it does not fit in the embed, followed by the conflicted file's content.
+        """
+        files = []
+        base_name = os.path.basename(self.conflict.path)
+        if self.conflict.diff and len(self.conflict.diff) > MAX_EMBED_LENGTH:
+            files.append(temporary_file(self.conflict.diff, filename=f"{base_name}.diff.txt"))
+
+        files.append(temporary_file(self.conflict.content, base_name))
+        return files
+
+    @property
+    def files(self) -> list[discord.File] | None:
+        if not self._files_created:
+            self._files = self._create_files()
+            self._files_created = True
+        return self._files
+
+    @files.setter
+    def files(self, value: list[discord.File] | None):
+        self._files = value
+        self._files_created = True
+
+    def update_files(self) -> list[discord.File] | None:
+        # creates the attachments on first display
+        self.files
+        return super().update_files()
 
     async def callback(self, interaction: discord.Interaction | None = None):
         # Called when this page is displayed
@@ -207,10 +256,13 @@ class MergeConflictPage(discord.ext.pages.Page):
 # noinspection PyRedeclaration
 class MergeConflictsPaginator(AsyncPaginator):
     def __init__(self, conflicts: list[MergeConflict], **kwargs):
-        future = asyncio.get_running_loop().create_future()
-        conflicts_ctx = MergeConflictsContext(conflicts, future, self._refresh)
-        pages = [MergeConflictPage(conflict, conflicts_ctx) for conflict in conflicts]
-        super().__init__(future, pages=pages, default_button_row=1, timeout=900 - 1, trigger_on_display=True, **kwargs)
+        self.ctx = MergeConflictsContext(conflicts, None, self._refresh)
+        pages = [MergeConflictPage(conflict, self.ctx) for conflict in conflicts]
+        super().__init__(None, pages=pages, default_button_row=1, timeout=900 - 1, trigger_on_display=True, **kwargs)
+
+    @property
+    def future(self) -> Future:
+        return self.ctx.future
 
     async def _refresh(self):
         await self.goto_page(self.current_page)
@@ -9,6 +9,30 @@ from ..awaitable.modal import BeginPortModal
 from ..git import PullRequestId
 
 
+async def _write_lines(status: StatusMessage, lines: list[str], chunk_length: int = 1500):
+    """
+    Writes lines to a status message, flushing whenever roughly ``chunk_length`` characters have been written.
+    :param status:
+    :param lines:
+    :param chunk_length:
+    :return:
+    """
+    chunk: list[str] = []
+    length = 0
+    for line in lines:
+        chunk.append(line)
+        chunk.append("\n")
+        length += len(line) + 1
+        if length > chunk_length:
+            await status.write_line("".join(chunk))
+            await status.flush()
+            chunk.clear()
+            length = 0
+
+    await status.write_line("".join(chunk))
+    await status.flush()
+
+
 class MyView(discord.ui.View):
     def __init__(self, port_callback: Callable[[str], Coroutine[Any, Any, None]], morticia: Morticia, pull_request_url: str, *items: Item):
         super().__init__(*items)
@@ -34,17 +58,7 @@ class MyView(discord.ui.View):
         await status.write_line(f"Fetching ancestors ...")
         await status.flush()
 
-        ancestors = ""
-        for ancestor in self.morticia.get_ancestors(self.pull_request_id):
-            ancestors += ancestor + "\n"
-
-            if len(ancestors) > 1500:
-                await status.write_line(ancestors)
-                await status.flush()
-                ancestors = ""
-
-        await status.write_line(ancestors)
-        await status.flush()
+        await _write_lines(status, await self.morticia.get_ancestors(self.pull_request_id))
 
         await status.write_line("Finished.")
         await status.flush()
@@ -55,17 +69,7 @@ class MyView(discord.ui.View):
         await status.write_line(f"Fetching descendants ...")
         await status.flush()
 
-        descendants = ""
-        for descendant in self.morticia.get_descendants(self.pull_request_id):
-            descendants += descendant + "\n"
-
-            if len(descendants) > 1500:
-                await status.write_line(descendants)
-                await status.flush()
-                descendants = ""
-
-        await status.write_line(descendants)
-        await status.flush()
+        await _write_lines(status, await self.morticia.get_descendants(self.pull_request_id))
 
         await status.write_line("Finished.")
         await status.flush()
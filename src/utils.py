@@ -1,5 +1,9 @@
 import io
 import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
 
 import discord
 
@@ -7,31 +11,75 @@ from src.git import RepoId, PullRequestId
 
 
 def pretty_duration(seconds: int) -> str:
-    minutes, seconds = divmod(seconds, 60)
-    minutes = int(minutes)
-    seconds = int(seconds)
-    pretty_time = ""
+    minutes, seconds = divmod(int(seconds), 60)
+    parts = []
     if minutes > 0:
-        minutes_text = minutes > 1 and "minutes" or "minute"
-        pretty_time += f"{minutes:.0f} {minutes_text}"
+        parts.append(f"{minutes} minute{'s' if minutes > 1 else ''}")
     if seconds > 0:
-        if minutes > 0:
-            pretty_time += " and "
-        seconds_text = int(seconds) > 1 and "seconds" or "second"
-        pretty_time += f"{seconds:.0f} {seconds_text}"
-    return pretty_time
+        parts.append(f"{seconds} second{'s' if seconds > 1 else ''}")
+    return " and ".join(parts)
 
 
-PULL_REQUEST_LINK_PATTERN = re.compile(r"(https://github.com/[\w\-_]+/[\w\-_]+/pull/\d+)")
+class ExpiringCache:
+    """
+    A dictionary whose entries are forgotten ``ttl`` seconds after being set. Once it holds ``maxsize`` entries,
+    setting another evicts the oldest. Safe to share between worker threads.
+    """
+    def __init__(self, ttl: float, maxsize: int = 1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        # every entry lives for the same ttl, so insertion order is also expiry order
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return default
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._entries.pop(key, None)
+            while self._entries:
+                oldest_key = next(iter(self._entries))
+                expires_at, _ = self._entries[oldest_key]
+                if expires_at >= now and len(self._entries) < self.maxsize:
+                    break
+                self._entries.popitem(last=False)
+            self._entries[key] = (now + self.ttl, value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+# the ids are built from the groups of a single match, rather than parsing each found url again
+PULL_REQUEST_LINK_PATTERN = re.compile(r"https://github\.com/([\w\-_]+)/([\w\-_]+)/pull/(\d+)")
 def parse_pull_request_urls(text: str) -> list[PullRequestId]:
-    urls = re.findall(PULL_REQUEST_LINK_PATTERN, text)
-    return [PullRequestId.from_url(url) for url in urls]
+    if "github.com" not in text:
+        return []
+    pull_request_ids = []
+    for match in PULL_REQUEST_LINK_PATTERN.finditer(text):
+        pull_request_id = PullRequestId()
+        pull_request_id.org_name = match.group(1).lower()
+        pull_request_id.repo_name = match.group(2).lower()
+        pull_request_id.number = int(match.group(3))
+        pull_request_ids.append(pull_request_id)
+    return pull_request_ids
 
 
-REPO_LINK_PATTERN = re.compile(r"(https://github.com/[\w\-_]+/[\w\-_]+/?)")
+REPO_LINK_PATTERN = re.compile(r"https://github\.com/([\w\-_]+)/([\w\-_]+)/?")
 def parse_repo_urls(text: str) -> list[RepoId]:
-    urls = re.findall(REPO_LINK_PATTERN, text)
-    return [RepoId.from_url(url) for url in urls]
+    if "github.com" not in text:
+        return []
+    return [RepoId(match.group(1).lower(), match.group(2).lower()) for match in REPO_LINK_PATTERN.finditer(text)]
 
 
 IMPLICIT_ISSUE_PATTERN = re.compile(r"(?:^|[^\w`])(#\d+)(?:[^\w`]|$)")
@@ -42,6 +90,9 @@ def qualify_implicit_issues(message: str, repo_id: RepoId) -> str:
     :param repo_id:
     :return:
     """
+    # most descriptions reference no issues, so don't run the pattern over them at all
+    if "#" not in message:
+        return message
     return IMPLICIT_ISSUE_PATTERN.sub(rf" `{repo_id}\1`", message)
 
 